@@ -4,8 +4,18 @@ from pathlib import Path
 DB_PATH = Path(__file__).resolve().parent / "scanner.db"
 
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    # isolation_level=None: kein implizites BEGIN durch den Treiber;
+    # Transaktionen laufen explizit über BEGIN/COMMIT wo nötig.
+    # cached_statements: wiederholte INSERT/SELECTs bleiben prepared.
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # WAL + synchronous=NORMAL: deutlich schnellere Commits (ein fsync statt zwei),
+    # Reader blockieren Writer nicht mehr.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
 def init_db() -> None:
@@ -24,6 +34,12 @@ def init_db() -> None:
             PRIMARY KEY (ticker, window, asof_date)
         )
         """)
+        # Covering Index für den Scan-Query (WHERE window=? AND asof_date=?):
+        # SQLite beantwortet ticker+rv direkt aus dem Index, ohne Row-Lookups
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rv_wd_asof
+        ON realized_vol(window, asof_date, ticker, rv)
+        """)
         conn.execute("""
         CREATE TABLE IF NOT EXISTS spot_close (
             ticker TEXT NOT NULL,
@@ -32,4 +48,22 @@ def init_db() -> None:
             PRIMARY KEY (ticker, date)
         )
         """)
+        # vorberechnetes Scan-Ranking (siehe /api/scan + /api/scan/refresh)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS scan_results (
+            ticker TEXT NOT NULL,
+            asof_date TEXT NOT NULL,
+            spot REAL,
+            iv REAL,
+            rv20 REAL,
+            iv_rv_ratio REAL,
+            delta REAL,
+            option_symbol TEXT,
+            PRIMARY KEY (ticker, asof_date)
+        )
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scan_asof_ratio
+        ON scan_results(asof_date, iv_rv_ratio DESC)
+        """)
         conn.commit()
@@ -1,10 +1,13 @@
 import os
-import time
+import asyncio
+import json
 import math
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, timedelta
 
-import requests
+import aiohttp
+import numpy as np
 import pandas as pd
 
 
@@ -18,27 +21,35 @@ FROM_DATE = os.environ.get("FROM_DATE", (date.today() - timedelta(days=365 * 2))
 TO_DATE = os.environ.get("TO_DATE", (date.today() - timedelta(days=1)).isoformat())  # bis gestern
 RV_WINDOWS = [20, 60]  # RV_20 und RV_60
 
+# Concurrency-Limits: Workload ist I/O-bound (Netzwerk-Latenz), nicht CPU
+MAX_CONCURRENCY = 64   # gleichzeitige Requests insgesamt
+MAX_PER_HOST = 16      # pro Host (MarketData)
+FETCH_CHUNK = 200      # Ticker pro gather-Batch (begrenzt Memory)
+UPSERT_BATCH_ROWS = 10_000  # Rows pro Transaktion beim Schreiben
+PARSE_WORKERS = os.cpu_count() or 1  # Prozesse für JSON->Rows (CPU-Teil)
+
 
 def read_tickers(csv_path: str) -> list[str]:
-    df = pd.read_csv(csv_path, header=None)
+    df = pd.read_csv(csv_path, header=None, dtype=str)
 
     # Falls nur eine Spalte vorhanden ist
     if df.shape[1] == 1:
-        tickers = df.iloc[:, 0].dropna().astype(str).str.strip().tolist()
-        tickers = [t for t in tickers if t and t.upper() != "NAN"]
-        return sorted(list(dict.fromkeys([t.upper() for t in tickers])))
-
-    # Falls mehrere Spalten vorhanden sind
-    for col in ["ticker", "symbol", "Ticker", "Symbol"]:
-        if col in df.columns:
-            tickers = df[col].dropna().astype(str).str.strip().tolist()
-            tickers = [t for t in tickers if t and t.upper() != "NAN"]
-            return sorted(list(dict.fromkeys([t.upper() for t in tickers])))
-
-    raise ValueError(f"Ticker-Spalte nicht gefunden in {csv_path}.")
-
-
-def md_get_candles_daily(symbol: str, from_date: str, to_date: str, session: requests.Session) -> dict:
+        s = df.iloc[:, 0]
+    else:
+        # Falls mehrere Spalten: Header-Zeile (Zeile 0 bei header=None)
+        # nach ticker/symbol absuchen
+        first = df.iloc[0].fillna("").str.strip().str.lower()
+        match = first.isin(["ticker", "symbol"])
+        if not match.any():
+            raise ValueError(f"Ticker-Spalte nicht gefunden in {csv_path}.")
+        s = df.iloc[1:, int(match.idxmax())]
+
+    # ein vektorisierter Pass: normalisieren, filtern, hash-basiert dedupen
+    s = s.dropna().str.strip().str.upper()
+    return sorted(s.loc[s.ne("") & s.ne("NAN")].unique().tolist())
+
+
+async def md_get_candles_daily(session: aiohttp.ClientSession, symbol: str, from_date: str, to_date: str) -> dict:
     # D = daily resolution (laut Doku) :contentReference[oaicite:2]{index=2}
     url = f"{API_BASE}/stocks/candles/D/{symbol}/"
     params = {
@@ -53,20 +64,32 @@ def md_get_candles_daily(symbol: str, from_date: str, to_date: str, session: req
     last_err = None
     for attempt in range(1, 6):
         try:
-            r = session.get(url, params=params, headers=headers, timeout=30)
-            if r.status_code == 429:
-                # rate limit -> backoff
-                time.sleep(1.5 * attempt)
-                continue
-            r.raise_for_status()
-            return r.json()
+            async with session.get(url, params=params, headers=headers) as r:
+                if r.status == 429:
+                    # rate limit -> backoff; Retry-After Header respektieren falls vorhanden
+                    retry_after = r.headers.get("Retry-After")
+                    try:
+                        delay = float(retry_after) if retry_after else 1.5 * attempt
+                    except ValueError:
+                        delay = 1.5 * attempt
+                    await asyncio.sleep(delay)
+                    continue
+                r.raise_for_status()
+                return await r.json()
         except Exception as e:
             last_err = e
-            time.sleep(1.0 * attempt)
+            await asyncio.sleep(1.0 * attempt)
     raise RuntimeError(f"Failed candles for {symbol}: {last_err}")
 
 
 def ensure_db(conn: sqlite3.Connection) -> None:
+    # WAL + synchronous=NORMAL: ein fsync pro Commit statt zwei,
+    # Rest der Pragmas reduziert Temp-I/O beim Bulk-Load.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    conn.execute("PRAGMA mmap_size=268435456")
     conn.execute("""
     CREATE TABLE IF NOT EXISTS underlying_prices (
         ticker TEXT NOT NULL,
@@ -78,58 +101,232 @@ def ensure_db(conn: sqlite3.Connection) -> None:
         PRIMARY KEY (ticker, dt)
     );
     """)
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_underlying_prices_ticker_dt ON underlying_prices(ticker, dt);")
+    # (ticker, dt DESC): get_latest_rv20 macht ORDER BY dt DESC LIMIT 1 ->
+    # ein Index-Seek statt Sort; ersetzt den alten ASC-Index
+    conn.execute("DROP INDEX IF EXISTS idx_underlying_prices_ticker_dt;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_underlying_prices_ticker_dt_desc ON underlying_prices(ticker, dt DESC);")
     conn.commit()
 
 
-def candles_json_to_df(symbol: str, j: dict) -> pd.DataFrame:
-    status = j.get("s")
-    if status != "ok":
-        return pd.DataFrame(columns=["ticker", "dt", "close"])
+def _rolling_std0(x: np.ndarray, w: int) -> np.ndarray:
+    # std (ddof=0) über ein volles Fenster; NaN wo das Fenster nicht gefüllt
+    # ist oder NaN enthält (entspricht rolling(w, min_periods=w).std(ddof=0))
+    out = np.full(x.size, np.nan)
+    if x.size >= w:
+        win = np.lib.stride_tricks.sliding_window_view(x, w)
+        out[w - 1 :] = win.std(axis=1, ddof=0)
+    return out
+
+
+def _rolling_std0_multi(x: np.ndarray, windows: list[int]) -> dict[int, np.ndarray]:
+    # alle Fenster in einem Pass: cumsum(r) + cumsum(r^2) einmal, dann ist
+    # jede Fenster-Varianz nur noch zwei Differenzen (O(n) statt O(n*w)).
+    # Voraussetzung: NaNs nur als Prefix (Normalfall: erster Log-Return);
+    # bei NaN mittendrin exakter Fallback pro Fenster. Log-Returns sind
+    # klein, daher ist die cumsum-Auslöschung hier unkritisch.
+    n = x.size
+    valid = np.isfinite(x)
+    first_valid = int(np.argmax(valid)) if valid.any() else n
+    prefix_only = bool(valid[first_valid:].all())
+
+    if not prefix_only or first_valid >= n:
+        return {w: _rolling_std0(x, w) for w in windows}
+
+    r = x[first_valid:]
+    cs = np.concatenate(([0.0], np.cumsum(r)))
+    cs2 = np.concatenate(([0.0], np.cumsum(r * r)))
+
+    out = {}
+    for w in windows:
+        res = np.full(n, np.nan)
+        if r.size >= w:
+            sum_w = cs[w:] - cs[:-w]
+            sum2_w = cs2[w:] - cs2[:-w]
+            var = sum2_w / w - (sum_w / w) ** 2
+            np.maximum(var, 0.0, out=var)  # numerisches Rauschen abfangen
+            res[first_valid + w - 1 :] = np.sqrt(var)
+        out[w] = res
+    return out
+
+
+def candles_json_to_rows(symbol: str, j: dict) -> list[tuple]:
+    # JSON-Arrays direkt -> numpy -> Row-Tupel, ohne DataFrame-Zwischenschritt
+    if j.get("s") != "ok":
+        return []
 
     closes = j.get("c", [])
     times = j.get("t", [])
     if not closes or not times or len(closes) != len(times):
-        return pd.DataFrame(columns=["ticker", "dt", "close"])
+        return []
 
     # t ist unix timestamp (UTC). Daily returned without times in UI, aber API liefert t. :contentReference[oaicite:3]{index=3}
-    dt = pd.to_datetime(pd.Series(times, dtype="int64"), unit="s", utc=True).dt.date.astype(str)
-    df = pd.DataFrame({
-        "ticker": symbol,
-        "dt": dt,
-        "close": pd.Series(closes, dtype="float64"),
-    })
-    df = df.sort_values("dt").reset_index(drop=True)
-    return df
+    ts = np.asarray(times, dtype=np.int64)
+    c = np.asarray(closes, dtype=np.float64)
+    order = np.argsort(ts, kind="stable")
+    ts = ts[order]
+    c = c[order]
 
+    dates = np.datetime_as_string(ts.astype("datetime64[s]"), unit="D")
 
-def add_rv_features(df: pd.DataFrame) -> pd.DataFrame:
-    # log_return = ln(C_t / C_{t-1})
-    df["log_return"] = (df["close"] / df["close"].shift(1)).apply(lambda x: math.log(x) if pd.notna(x) and x > 0 else None)
+    # log_return = ln(C_t / C_{t-1}); ratio <= 0 -> NaN
+    logret = np.full(c.size, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = c[1:] / c[:-1]
+        logret[1:] = np.log(np.where(ratio > 0, ratio, np.nan))
 
-    # annualize: sqrt(252) * std(returns_window)
+    # annualize: sqrt(252) * std(returns_window); beide Fenster in einem Pass
     ann = math.sqrt(252.0)
-    for w in RV_WINDOWS:
-        col = f"rv_{w}"
-        df[col] = df["log_return"].rolling(window=w, min_periods=w).std(ddof=0) * ann
-
-    return df
-
-
-def upsert_prices(conn: sqlite3.Connection, df: pd.DataFrame) -> None:
-    rows = df[["ticker", "dt", "close", "log_return", "rv_20", "rv_60"]].to_records(index=False)
-    conn.executemany("""
-        INSERT INTO underlying_prices (ticker, dt, close, log_return, rv_20, rv_60)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(ticker, dt) DO UPDATE SET
-            close=excluded.close,
-            log_return=excluded.log_return,
-            rv_20=excluded.rv_20,
-            rv_60=excluded.rv_60;
-    """, list(rows))
+    stds = _rolling_std0_multi(logret, RV_WINDOWS)
+    rv_cols = [stds[w] * ann for w in RV_WINDOWS]
+
+    def _f(v: float):
+        return float(v) if np.isfinite(v) else None
+
+    return [
+        (symbol, str(d), float(cl), _f(lr), *(_f(col[i]) for col in rv_cols))
+        for i, (d, cl, lr) in enumerate(zip(dates, c, logret))
+    ]
+
+
+# Multi-VALUES Insert: 500 Rows pro Statement (3000 Bind-Parameter,
+# bleibt unter dem SQLite-Limit); Fallback falls json_each fehlt
+MULTI_VALUES_GROUP = 500
+
+UPSERT_CONFLICT = """
+    ON CONFLICT(ticker, dt) DO UPDATE SET
+        close=excluded.close,
+        log_return=excluded.log_return,
+        rv_20=excluded.rv_20,
+        rv_60=excluded.rv_60;
+"""
+
+# Alle Rows als ein JSON-Blob an SQLite schicken und serverseitig via
+# json_each explodieren lassen: ein Statement, ein Roundtrip, kein
+# per-Row Binding über die Python<->SQLite Grenze. Row = [t,d,c,lr,rv20,rv60].
+JSON_UPSERT_SQL = f"""
+    INSERT INTO underlying_prices (ticker, dt, close, log_return, rv_20, rv_60)
+    SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'),
+           json_extract(value, '$[2]'), json_extract(value, '$[3]'),
+           json_extract(value, '$[4]'), json_extract(value, '$[5]')
+    FROM json_each(?)
+    WHERE true
+    {UPSERT_CONFLICT}
+"""
+# WHERE true: nötig, damit der Parser ON CONFLICT nicht als Join-ON liest
+
+
+def _has_json_each(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("SELECT 1 FROM json_each('[]')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _upsert_sql(n_rows: int) -> str:
+    values = ", ".join(["(?, ?, ?, ?, ?, ?)"] * n_rows)
+    return f"""
+    INSERT INTO underlying_prices (ticker, dt, close, log_return, rv_20, rv_60)
+    VALUES {values}
+    {UPSERT_CONFLICT}
+    """
+
+
+def flush_rows(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    # eine große Transaktion statt commit pro Ticker
+    if not rows:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    if _has_json_each(conn):
+        conn.execute(JSON_UPSERT_SQL, (json.dumps([list(r) for r in rows]),))
+    else:
+        for i in range(0, len(rows), MULTI_VALUES_GROUP):
+            chunk = rows[i : i + MULTI_VALUES_GROUP]
+            # volle Chunks haben identisches SQL -> Statement-Cache greift
+            flat = [v for row in chunk for v in row]
+            conn.execute(_upsert_sql(len(chunk)), flat)
     conn.commit()
 
 
+async def fetch_ticker(
+    session: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    ticker: str,
+    queue: asyncio.Queue,
+    pool: ProcessPoolExecutor,
+) -> None:
+    async with sem:
+        try:
+            j = await md_get_candles_daily(session, ticker, FROM_DATE, TO_DATE)
+        except Exception as e:
+            await queue.put((ticker, None, e))
+            return
+
+    # CPU-Teil (JSON -> Rows inkl. RV) in den Prozess-Pool auslagern;
+    # der Event-Loop bleibt frei für die laufenden Fetches
+    try:
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(pool, candles_json_to_rows, ticker, j)
+        await queue.put((ticker, rows, None))
+    except Exception as e:
+        await queue.put((ticker, None, e))
+
+
+async def db_writer(conn: sqlite3.Connection, queue: asyncio.Queue, total: int, stats: dict) -> None:
+    # Einziger Writer -> SQLite single-writer Invariante bleibt erhalten.
+    # Rows werden gesammelt und in großen Transaktionen geschrieben statt
+    # commit pro Ticker (fsync pro Ticker dominiert sonst die Schreibzeit).
+    pending: list[tuple] = []
+
+    for i in range(1, total + 1):
+        ticker, rows, err = await queue.get()
+
+        if err is not None:
+            stats["failed"] += 1
+            print(f"[{i}/{total}] {ticker}: FAILED -> {err}")
+            continue
+
+        if not rows:
+            stats["no_data"] += 1
+            print(f"[{i}/{total}] {ticker}: no_data")
+            continue
+
+        pending.extend(rows)
+        stats["ok"] += 1
+
+        if len(pending) >= UPSERT_BATCH_ROWS:
+            flush_rows(conn, pending)
+            pending = []
+
+        if i % 25 == 0:
+            print(f"Progress: {i}/{total} | ok={stats['ok']}, no_data={stats['no_data']}, failed={stats['failed']}")
+
+    flush_rows(conn, pending)
+
+
+async def run_backfill(conn: sqlite3.Connection, tickers: list[str]) -> dict:
+    stats = {"ok": 0, "no_data": 0, "failed": 0}
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    connector = aiohttp.TCPConnector(limit_per_host=MAX_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=30)
+
+    # Prozess-Pool für den CPU-Teil, genau EIN Writer für SQLite
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            writer = asyncio.create_task(db_writer(conn, queue, len(tickers), stats))
+
+            # in Chunks gathern, damit nicht alle Responses gleichzeitig im Speicher liegen
+            for i in range(0, len(tickers), FETCH_CHUNK):
+                chunk = tickers[i : i + FETCH_CHUNK]
+                await asyncio.gather(*[fetch_ticker(session, sem, t, queue, pool) for t in chunk])
+
+            await writer
+
+    return stats
+
+
 def main():
     if not API_KEY:
         print("WARN: MARKETDATA_API_KEY ist leer. Falls du Auth brauchst, setze die ENV-Variable.")
@@ -140,37 +337,24 @@ def main():
     print(f"Backfill range: {FROM_DATE} -> {TO_DATE}")
 
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    # isolation_level=None: Transaktionen werden explizit in flush_rows gemanagt;
+    # cached_statements hält die wiederholten Upsert-Statements prepared
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=256)
     ensure_db(conn)
 
-    session = requests.Session()
+    # Sekundärindex für die Dauer des Bulk-Loads droppen: ein One-Shot-Rebuild
+    # danach ist deutlich billiger als B-Tree-Maintenance pro Insert.
+    # Der Primary Key bleibt (wird für den Upsert gebraucht).
+    conn.execute("DROP INDEX IF EXISTS idx_underlying_prices_ticker_dt_desc")
 
-    ok = 0
-    no_data = 0
-    failed = 0
-
-    for i, t in enumerate(tickers, start=1):
-        try:
-            j = md_get_candles_daily(t, FROM_DATE, TO_DATE, session=session)
-            df = candles_json_to_df(t, j)
-            if df.empty:
-                no_data += 1
-                print(f"[{i}/{len(tickers)}] {t}: no_data")
-                continue
+    stats = asyncio.run(run_backfill(conn, tickers))
 
-            df = add_rv_features(df)
-            upsert_prices(conn, df)
-            ok += 1
-
-            if i % 25 == 0:
-                print(f"Progress: {i}/{len(tickers)} | ok={ok}, no_data={no_data}, failed={failed}")
-
-        except Exception as e:
-            failed += 1
-            print(f"[{i}/{len(tickers)}] {t}: FAILED -> {e}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_underlying_prices_ticker_dt_desc ON underlying_prices(ticker, dt DESC)")
+    # Statistiken für den Query-Planner aktualisieren
+    conn.execute("ANALYZE")
 
     conn.close()
-    print(f"DONE | ok={ok}, no_data={no_data}, failed={failed}")
+    print(f"DONE | ok={stats['ok']}, no_data={stats['no_data']}, failed={stats['failed']}")
     print(f"DB: {DB_PATH}")
 
 
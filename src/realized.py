@@ -1,25 +1,34 @@
-import math
 from datetime import datetime
-import requests
+
+import numpy as np
+
+from .realized_kernels import rv_windows
+from .services.marketdata_client import SESSION
 
 def realized_vol_annualized_from_closes(closes: list[float], window: int = 30) -> float | None:
     if len(closes) < window + 1:
         return None
-    # log returns
-    rets = []
-    for i in range(1, len(closes)):
-        c0, c1 = closes[i-1], closes[i]
-        if c0 is None or c1 is None or c0 <= 0 or c1 <= 0:
-            return None
-        rets.append(math.log(c1 / c0))
+    # None wird von numpy zu NaN -> ein Validitäts-Check statt per-Element-Loop
+    c = np.asarray(closes, dtype=np.float64)
+    if not np.isfinite(c).all() or not (c > 0).all():
+        return None
+    # log returns, vektorisiert
+    rets = np.log(c[1:] / c[:-1])
     # take last window
     w = rets[-window:]
-    if len(w) < window:
+    if w.size < window:
         return None
-    mean = sum(w) / len(w)
-    var = sum((x - mean) ** 2 for x in w) / (len(w) - 1)
     # annualize with 252
-    return math.sqrt(var * 252.0)
+    return float(np.sqrt(w.var(ddof=1) * 252.0))
+
+def realized_vols_annualized_from_closes(closes: list[float], windows: tuple[int, ...] = (20, 60)) -> dict[int, float | None]:
+    # Batch-Variante für mehrere Fenster: Log-Returns werden nur einmal
+    # berechnet (JIT-Kernel in realized_kernels, falls numba installiert)
+    c = np.asarray(closes, dtype=np.float64)
+    if c.size < 2 or not np.isfinite(c).all() or not (c > 0).all():
+        return {int(w): None for w in windows}
+    out = rv_windows(c, np.asarray(windows, dtype=np.int64))
+    return {int(w): (float(v) if np.isfinite(v) else None) for w, v in zip(windows, out)}
 
 def fetch_daily_closes_marketdata(ticker: str, api_key: str, lookback_days: int = 260) -> tuple[list[str], list[float]]:
     # MarketData candles endpoint (daily). Du hast MarketData Trader.
@@ -29,7 +38,7 @@ def fetch_daily_closes_marketdata(ticker: str, api_key: str, lookback_days: int
         "countback": lookback_days,
         "token": api_key
     }
-    r = requests.get(url, params=params, timeout=30)
+    r = SESSION.get(url, params=params, timeout=30)
     r.raise_for_status()
     j = r.json()
     if j.get("s") != "ok":
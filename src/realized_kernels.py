@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+# Numba ist optional (siehe requirements.txt): mit numba wird der
+# Ein-Pass-Kernel JIT-kompiliert, ohne numba läuft ein vektorisierter
+# NumPy-Fallback mit identischem Ergebnis.
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # pragma: no cover
+    HAVE_NUMBA = False
+
+
+def _rv_windows_kernel(closes: np.ndarray, windows: np.ndarray) -> np.ndarray:
+    """
+    Annualisierte Realized Vol über mehrere Fenster in einem Pass.
+
+    closes:  float64 array (chronologisch), nur positive Werte
+    windows: int64 array, z.B. np.array([20, 60])
+    Rückgabe: float64 array, NaN wo das Fenster nicht gefüllt ist.
+
+    Ein Durchlauf berechnet die Log-Returns einmal; pro Fenster nur noch
+    laufende Summen über die letzten w Returns (ddof=1, wie
+    realized_vol_annualized_from_closes).
+    """
+    n = closes.shape[0]
+    out = np.empty(windows.shape[0])
+
+    if n < 2:
+        out[:] = np.nan
+        return out
+
+    logret = np.empty(n - 1)
+    for i in range(1, n):
+        logret[i - 1] = math.log(closes[i] / closes[i - 1])
+
+    for k in range(windows.shape[0]):
+        w = windows[k]
+        if w < 2 or w > n - 1:
+            out[k] = np.nan
+            continue
+        s = 0.0
+        s2 = 0.0
+        for j in range(n - 1 - w, n - 1):
+            s += logret[j]
+            s2 += logret[j] * logret[j]
+        mean = s / w
+        var = (s2 - w * mean * mean) / (w - 1)
+        if var < 0.0:  # numerisches Rauschen bei konstanten Closes
+            var = 0.0
+        out[k] = math.sqrt(var * 252.0)
+
+    return out
+
+
+def _rv_windows_numpy(closes: np.ndarray, windows: np.ndarray) -> np.ndarray:
+    # Fallback ohne numba: Log-Returns einmal vektorisiert, dann pro Fenster
+    # eine ddof=1-Varianz über den Tail-Slice (gleiche Semantik wie der Kernel)
+    n = closes.shape[0]
+    out = np.full(windows.shape[0], np.nan)
+
+    if n < 2:
+        return out
+
+    logret = np.log(closes[1:] / closes[:-1])
+    for k, w in enumerate(windows):
+        if 2 <= w <= n - 1:
+            out[k] = math.sqrt(max(float(logret[-w:].var(ddof=1)), 0.0) * 252.0)
+
+    return out
+
+
+if HAVE_NUMBA:
+    rv_windows = njit(cache=True, fastmath=True)(_rv_windows_kernel)
+else:
+    rv_windows = _rv_windows_numpy
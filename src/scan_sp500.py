@@ -3,11 +3,39 @@ from __future__ import annotations
 import os
 import math
 import sqlite3
+import threading
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
+from .services.marketdata_client import make_session
+
+
+# ----------------------------
+# HTTP: Session pro Thread + Limit für parallele Calls
+# ----------------------------
+# scan_sp500 in main.py ruft get_atm_iv_for_ticker aus einem ThreadPool auf;
+# requests.Session ist nicht thread-safe -> eine Session pro Worker-Thread
+# (mit Keep-Alive-Pooling + Retry aus services.marketdata_client).
+_tls = threading.local()
+
+# begrenzt gleichzeitige ausgehende Requests (Rate-Limit-Schutz)
+_http_sem = threading.Semaphore(16)
+
+
+def _session() -> requests.Session:
+    s = getattr(_tls, "session", None)
+    if s is None:
+        s = make_session()
+        _tls.session = s
+    return s
+
+
+def _http_get(url: str, params: Dict[str, Any], timeout: float) -> requests.Response:
+    with _http_sem:
+        return _session().get(url, params=params, timeout=timeout)
+
 
 # ----------------------------
 # Helpers
@@ -53,11 +81,42 @@ def get_latest_rv20(ticker: str, db_path: str = "data/prices.db") -> Optional[fl
         return None
 
 
+def get_latest_rv20_map(tickers: List[str], db_path: str = "data/prices.db") -> Dict[str, float]:
+    """
+    Holt die jeweils letzte rv_20 für alle Ticker in EINEM Query statt
+    eine Connection + Query pro Ticker (scan() ruft das einmal auf).
+    """
+    wanted = {t.strip().upper() for t in tickers if t}
+    out: Dict[str, float] = {}
+    try:
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute(
+            """
+            SELECT ticker, rv_20 FROM (
+                SELECT ticker, rv_20,
+                       ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY dt DESC) AS rn
+                FROM underlying_prices
+            )
+            WHERE rn = 1
+            """
+        ).fetchall()
+        conn.close()
+    except Exception:
+        return out
+
+    for ticker, rv in rows:
+        if ticker in wanted:
+            v = _safe_float(rv)
+            if v is not None:
+                out[ticker] = v
+    return out
+
+
 # ----------------------------
 # MarketData via lokale API Endpoints
 # ----------------------------
 def fetch_chain_symbols(base_url: str, ticker: str) -> List[str]:
-    r = requests.get(f"{base_url}/api/options/chain", params={"ticker": ticker}, timeout=30)
+    r = _http_get(f"{base_url}/api/options/chain", params={"ticker": ticker}, timeout=30)
     r.raise_for_status()
     j = r.json()
     if j.get("s") != "ok":
@@ -67,7 +126,7 @@ def fetch_chain_symbols(base_url: str, ticker: str) -> List[str]:
 
 
 def fetch_spot(base_url: str, ticker: str) -> Optional[float]:
-    r = requests.get(f"{base_url}/api/stocks/price", params={"ticker": ticker}, timeout=20)
+    r = _http_get(f"{base_url}/api/stocks/price", params={"ticker": ticker}, timeout=20)
     r.raise_for_status()
     j = r.json()
     if j.get("s") != "ok":
@@ -108,7 +167,7 @@ def fetch_quotes_batch_chunked(
     for i in range(0, len(uniq), chunk_size):
         chunk = uniq[i : i + chunk_size]
         try:
-            r = requests.get(
+            r = _http_get(
                 f"{base_url}/api/options/quotes_batch",
                 params={"symbols": ",".join(chunk), "limit": len(chunk)},
                 timeout=45,
@@ -203,15 +262,21 @@ def score_iv_gap(iv: Optional[float], rv: Optional[float]) -> Tuple[Optional[flo
     return gap, score
 
 
-def compute_iv_rv_score(ticker: str, base_url: str = "http://127.0.0.1:8000") -> Optional[Dict[str, Any]]:
+def compute_iv_rv_score(
+    ticker: str,
+    base_url: str = "http://127.0.0.1:8000",
+    rv_map: Optional[Dict[str, float]] = None,
+) -> Optional[Dict[str, Any]]:
     """
-    Minimal: iv/rv Ratio Ranking
+    Minimal: iv/rv Ratio Ranking.
+    rv_map: vorab via get_latest_rv20_map geholte rv_20-Werte; ohne rv_map
+    fällt die Funktion auf den Einzel-Lookup zurück.
     """
     t = ticker.strip().upper()
 
     atm = get_atm_iv_for_ticker(base_url, t, max_quotes=80)
     iv = _safe_float(atm.get("iv"))
-    rv = get_latest_rv20(t)
+    rv = rv_map.get(t) if rv_map is not None else get_latest_rv20(t)
 
     if iv is None or rv is None or rv == 0:
         return None
@@ -0,0 +1,27 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session() -> requests.Session:
+    """
+    Session mit Keep-Alive-Pooling + Retry (inkl. 429 mit Retry-After).
+    TCP/TLS-Handshake pro Request ist sonst der dominante Kostenfaktor.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+# modulglobale Session für single-threaded Caller (Endpoints in main.py,
+# realized.py); Worker-Threads bauen sich via make_session() eine eigene.
+SESSION = make_session()
@@ -1,5 +1,7 @@
 from pathlib import Path
 
+import pandas as pd
+
 def fetch_sp500_tickers():
     """
     Liest S&P 500 Ticker aus lokaler CSV.
@@ -13,14 +15,8 @@ def fetch_sp500_tickers():
     if not csv_path.exists():
         raise RuntimeError(f"sp500.csv not found at {csv_path}")
 
-    tickers = []
-
-    with open(csv_path, "r", encoding="utf-8") as f:
-        for line in f:
-            t = line.strip().upper()
-            if not t:
-                continue
-            t = t.replace(".", "-")
-            tickers.append(t)
+    # ein C-Level-Pass statt Zeilen-Loop in Python
+    s = pd.read_csv(csv_path, usecols=[0], header=None, dtype=str).iloc[:, 0]
+    s = s.dropna().str.strip().str.upper().str.replace(".", "-", regex=False)
 
-    return sorted(set(tickers))
+    return sorted({t for t in s.tolist() if t})